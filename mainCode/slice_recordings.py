@@ -5,12 +5,21 @@ of speaking features for each participant. The code puts all the sliced files in
  directory"""
 
 
-import shutil
+import os
+
+# every file is processed in its own worker process, so keep the numeric libraries from spawning
+# a thread per core inside each of them as well (must be set before numpy is imported)
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import csv
+import multiprocessing
 import numpy as np
-import librosa
-import librosa.display
 import soundfile as sf
-import os
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import groupby
 
 import noisereduce as nr
 
@@ -25,6 +34,10 @@ from unidecode import unidecode  # for removing special characters like é
 FRAME_SIZE = 1024
 HOP_LENGTH = 256
 
+# Sample rate the frame sizes and frame counts here were tuned at, files recorded at another rate get
+# proportionally scaled frame and hop sizes so every frame still covers the same duration
+TUNED_SAMPLE_RATE = 22050
+
 # Threshold to cross for rms (in percentage if rms is normalized and in dB otherwise)
 THRESHOLD = 0.015
 THRESHOLD_END = 0.015
@@ -35,6 +48,49 @@ MAX_PAUSE_FRAMES = 20
 # Whether to normalize rms while slicing
 NORMALIZE_RMS = True
 
+# Whether to run the noise suppression on noisereduce's torch implementation (requires torch) and on which
+# device, 'cuda' to use the gpu (falling back to the cpu on machines without a usable one)
+USE_TORCH = False
+TORCH_DEVICE = 'cpu'
+
+# Recordings whose loudest sample is below this peak are considered silent and are not sliced
+SILENCE_PEAK = 1e-3
+
+# How many standard deviations above the noise mean a frequency bin has to be to be kept by the noise reduction
+# (a single pass at 1.7 gives rms envelopes closest to the two passes at 1.5 that were used before)
+N_STD_THRESH_STATIONARY = 1.7
+
+# Captures the word uttered in the recording, which is written inside parentheses in the file name
+WORD_PATTERN = re.compile(r'\(([^)]*)\)')
+
+# Words not ending in one of these get their slice prolonged
+VOWELS = frozenset('aeiou')
+
+# Seconds of silence put between the recordings of a directory when their noise is reduced together,
+# longer than the stft window and the mask smoothing so the recordings don't affect each other
+BATCH_SEPARATOR_S = 0.1
+
+# Seconds at the start of each recording, before the participant speaks, to estimate the noise of a directory from,
+# None to estimate it from the recordings in full, either way taken once from the first batch of the directory
+# (N_STD_THRESH_STATIONARY was tuned for the whole recordings, a profile of only the room noise gives a lower
+# threshold and longer slices)
+NOISE_PROFILE_S = None
+
+# Maximal seconds of audio in a batch, the files of a directory sliced together by one worker (a longer file makes a
+# batch of its own), this bounds the decoded audio held for the workers to about MAX_PENDING_BATCHES * MAX_BATCH_S
+# seconds however many recordings a directory has
+MAX_BATCH_S = 20
+
+# Number of processes slicing files in parallel and how many batches are queued for them at a time, counting the
+# ones being sliced
+NUM_WORKERS = os.cpu_count()
+MAX_PENDING_BATCHES = 2 * NUM_WORKERS
+
+# Number of threads reading files from the disk ahead of the workers and how many files they may read ahead of the
+# batch being put together
+PREFETCH_THREADS = 4
+PREFETCH_QUEUE_SIZE = 32
+
 
 # user input
 def input_params():
@@ -53,21 +109,160 @@ def input_params():
     return source_directory, destination_directory, stimuli_path, destination_sliced_features_path  # do NOT change
 
 
+def _frame_sizes(audio_rate):
+    """Returns the frame and hop sizes to use for a file with the given sample rate"""
+    scale = audio_rate / TUNED_SAMPLE_RATE
+    return int(round(FRAME_SIZE * scale)), int(round(HOP_LENGTH * scale))
+
+
+def _fft_sizes(audio_rate):
+    """Returns the fft and hop sizes the noise suppression uses for a file with the given sample rate, the power
+    of two closest to the rms frame size (the same size at 22050 and 44100 Hz) so the fft stays on its fast path"""
+    frame_size, _ = _frame_sizes(audio_rate)
+    n_fft = 2 ** int(round(np.log2(frame_size)))
+    return n_fft, n_fft // 4
+
+
+def _frame_rms(audio_file, frame_size, hop_length):
+    """Computes the rms of every frame the same way librosa.feature.rms does (frames centered on multiples of
+    hop_length, zero padded at the edges) but from a running sum of the squared samples, so the frames are
+    never stacked in memory"""
+    padded = np.pad(audio_file, frame_size // 2)
+    squares_sum = np.concatenate(([0.0], np.cumsum(np.square(padded, dtype=np.float64))))
+    frame_starts = np.arange(0, padded.size - frame_size + 1, hop_length)
+    frame_power = (squares_sum[frame_starts + frame_size] - squares_sum[frame_starts]) / frame_size
+    # the running sum is kept in float64 for precision, the rms itself goes back to the dtype of the audio
+    rms = np.sqrt(np.maximum(frame_power, 0))  # rounding in the running sum can go slightly below 0
+    return rms.astype(audio_file.dtype, copy=False)
+
+
+def _pause_ends(rms_sound, threshold, max_pause_frames):
+    """Returns a mask of the frames that end a pause: max_pause_frames frames in a row below the threshold,
+    counting the frames before the start of the recording as below it"""
+    below = np.concatenate((np.ones(max_pause_frames - 1, dtype=np.int8), rms_sound < threshold))
+    window_sum = np.convolve(below, np.ones(max_pause_frames, dtype=int), mode='valid')
+    return window_sum == max_pause_frames
+
+
+def _expand_around_peak(rms_sound, middle, threshold, threshold_end, max_pause_frames):
+    """Expands left and right from the loudest frame for as long as the rms doesn't stay below the thresholds
+    for max_pause_frames frames in a row, returns the first and last frame of the expansion"""
+
+    # expanding to the left - stop at the closest frame to the left of middle that ends a pause
+    pause_ends = np.flatnonzero(_pause_ends(rms_sound, threshold, max_pause_frames))
+    i = np.searchsorted(pause_ends, middle, side='right') - 1
+    start = pause_ends[i] if i >= 0 else 0
+
+    # expanding to the right - the same search on the reversed rms finds the pauses starting right of middle
+    pause_starts = rms_sound.size - 1 - np.flatnonzero(_pause_ends(rms_sound[::-1], threshold_end,
+                                                                     max_pause_frames))[::-1]
+    i = np.searchsorted(pause_starts, middle, side='left')
+    end = pause_starts[i] if i < pause_starts.size else rms_sound.size - 1
+
+    return start, end
+
+
+@lru_cache(maxsize=None)
+def _torch_device():
+    """Returns the device to run the torch noise suppression on, TORCH_DEVICE unless it asks for cuda and no gpu
+    is available, since torch then fails on the first tensor moved to it instead of using the cpu"""
+    import torch  # only imported here so torch is needed just when it is used
+
+    if TORCH_DEVICE.startswith('cuda') and not torch.cuda.is_available():
+        print("no gpu available for the noise suppression, running it on the cpu")
+        return 'cpu'
+    return TORCH_DEVICE
+
+
+def _reduce_noise(audio_file, audio_rate, noise=None):
+    """Applies stationary noise suppression to the audio file, with torch if USE_TORCH is set.
+    The noise statistics are computed over all of noise if given and over the whole audio file otherwise
+    (noisereduce would clip noise to its first chunk_size samples, the torch gate to the length of the audio file)"""
+    n_fft, hop_length = _fft_sizes(audio_rate)
+
+    if USE_TORCH:
+        # only imported here so torch is needed just when it is used
+        from noisereduce.spectralgate.streamed_torch_gate import StreamedTorchGate
+
+        # built directly since nr.reduce_noise doesn't pass n_std_thresh_stationary on to the torch gate
+        gate = StreamedTorchGate(y=audio_file, sr=audio_rate, stationary=True, y_noise=noise,
+                                 n_std_thresh_stationary=N_STD_THRESH_STATIONARY, n_fft=n_fft, hop_length=hop_length,
+                                 clip_noise_stationary=False, device=_torch_device())
+        return gate.get_traces()
+
+    return nr.reduce_noise(y=audio_file, sr=audio_rate, y_noise=noise, n_std_thresh_stationary=N_STD_THRESH_STATIONARY,
+                           stationary=True, n_fft=n_fft, hop_length=hop_length, clip_noise_stationary=False)
+
+
+def _noise_profile(audio_files, audio_rate):
+    """Returns the audio the noise statistics are computed from, the recordings in full or only their beginnings
+    (see NOISE_PROFILE_S) concatenated, or None if there are no recordings"""
+    if not audio_files:
+        return None
+
+    if NOISE_PROFILE_S is None:
+        return np.concatenate(audio_files)
+    return np.concatenate([audio_file[:int(NOISE_PROFILE_S * audio_rate)] for audio_file in audio_files])
+
+
+def _reduce_noise_batch(audio_files, audio_rate, noise_profile=None):
+    """Applies the noise suppression to several recordings of the same session in a single call by
+    concatenating them with a short silence between them, and splits the result back into the recordings.
+    The noise statistics are computed once for all of them, over noise_profile if given and over the profile of
+    the recordings themselves otherwise (see _noise_profile), without the silences which would distort them"""
+    if not audio_files:
+        return []
+
+    if noise_profile is None:
+        noise_profile = _noise_profile(audio_files, audio_rate)
+    separator = np.zeros(int(BATCH_SEPARATOR_S * audio_rate), dtype=np.float32)
+    batch = np.concatenate([piece for audio_file in audio_files for piece in (audio_file, separator)])
+    reduced_batch = _reduce_noise(batch, audio_rate, noise=noise_profile)
+
+    reduced_files = []
+    position = 0
+    for audio_file in audio_files:
+        reduced_files.append(reduced_batch[position: position + audio_file.size])
+        position += audio_file.size + separator.size
+    return reduced_files
+
+
+def _can_be_sliced(audio_file, frame_size, hop_length, threshold=THRESHOLD, normalize_rms=NORMALIZE_RMS):
+    """Cheap checks on the raw audio file that reject recordings before the noise suppression is applied"""
+
+    # is the recording silent? then there is nothing to slice
+    if audio_file.size == 0 or np.max(np.abs(audio_file)) < SILENCE_PEAK:
+        return False
+
+    # noise suppression only removes energy, so without normalization a recording whose raw rms never
+    # crosses the threshold won't cross it after the suppression either
+    if not normalize_rms and np.max(_frame_rms(audio_file, frame_size, hop_length)) <= threshold:
+        return False
+
+    return True
+
+
 def slice_noise_reduced_audio_files_byt(audio_file, audio_rate, files_name, word,
                                         threshold=THRESHOLD, threshold_end=THRESHOLD_END,
-                                        normalize_rms=NORMALIZE_RMS):
+                                        normalize_rms=NORMALIZE_RMS, reduced_noise=None):
     """Receives an audio file, slices it using the hyperparameters provided and calculates
      the reaction time and duration of the participant.
-     The slicing is done by applying noise suppression several times, then finding the loudest point
+     The slicing is done by applying noise suppression (unless the noise suppressed audio is already given
+     in reduced_noise), then finding the loudest point
      in the recording and expanding left and right as long as the recording isn't below a certain threshold
      for too long (determined by the hyperparameters), the returned sliced recording is not noise suppressed"""
 
-    # applying noise suppression
-    reduced_noise = nr.reduce_noise(y=audio_file, sr=audio_rate, n_std_thresh_stationary=1.5, stationary=True)
-    audio_file2 = reduced_noise
-    reduced_noise = nr.reduce_noise(y=audio_file2, sr=audio_rate, n_std_thresh_stationary=1.5, stationary=True)
+    audio_file = audio_file.astype(np.float32, copy=False)
+    frame_size, hop_length = _frame_sizes(audio_rate)
+
+    if not _can_be_sliced(audio_file, frame_size, hop_length, threshold, normalize_rms):
+        return -1, -1, -1
 
-    rms_sound = librosa.feature.rms(y=reduced_noise, frame_length=FRAME_SIZE, hop_length=HOP_LENGTH)[0]
+    # applying noise suppression (noisereduce returns the dtype it is given, so everything stays float32)
+    if reduced_noise is None:
+        reduced_noise = _reduce_noise(audio_file, audio_rate)
+
+    rms_sound = _frame_rms(reduced_noise, frame_size, hop_length)
 
     # is the recording valid?
     if np.max(rms_sound) - np.min(rms_sound) == 0:
@@ -77,71 +272,50 @@ def slice_noise_reduced_audio_files_byt(audio_file, audio_rate, files_name, word
     if normalize_rms:
         rms_sound = (rms_sound - np.min(rms_sound)) / (np.max(rms_sound) - np.min(rms_sound))  # normalising the rms
 
-    frames = range(len(reduced_noise))
-    t = librosa.frames_to_time(frames, hop_length=HOP_LENGTH)
-
     middle = np.argmax(rms_sound)
 
-    # expanding to the left
-    start = middle
-    flag = True
-    while start >= 0 and flag:
-        if rms_sound[start] > threshold:
-            start -= 1
-        else:
-            count = 0
-            while start - count >= 0 and rms_sound[start-count] < threshold and count < MAX_PAUSE_FRAMES:
-                count += 1
-            if start - count == -1 or count == MAX_PAUSE_FRAMES:
-                flag = False
-            else:
-                start -= count
-
-    # expanding to the right
-    end = middle
-    flag = True
-    while end < rms_sound.size and flag:
-        if rms_sound[end] > threshold_end:
-            end += 1
-        else:
-            count = 0
-            while end + count < rms_sound.size and rms_sound[end+count] < threshold_end and count < MAX_PAUSE_FRAMES:
-                count += 1
-            if end + count == rms_sound.size or count == MAX_PAUSE_FRAMES:
-                flag = False
-            else:
-                end += count
+    start, end = _expand_around_peak(rms_sound, middle, threshold, threshold_end, MAX_PAUSE_FRAMES)
 
-    # if the word ends in a vowel then prolong the end a bit as vowels tend to get stretched
-    if word[-1] != 'a' and word[-1] != 'e' and word[-1] != 'i' and word[-1] != 'o' and word[-1] != 'u':
+    # if the word ends in a consonant then prolong the end a bit, as the quiet release of a final consonant
+    # tends to fall below the threshold while a final vowel is loud enough to be caught by the expansion
+    if word[-1:] not in VOWELS:
         end += 12
         if end >= rms_sound.size:
             end = rms_sound.size - 1
 
-    sound_s = audio_file[start * HOP_LENGTH: end * HOP_LENGTH + FRAME_SIZE]
-    total_duration = t[end] - t[start]
-    return sound_s, t[start], total_duration
+    sound_s = audio_file[start * hop_length: end * hop_length + frame_size]
+    onset_time = start * hop_length / audio_rate
+    end_time = end * hop_length / audio_rate
+    total_duration = end_time - onset_time
+    return sound_s, onset_time, total_duration
 
 
-def process_wav_file(input_file, output_directory, relative_path, robot_times):
-    """ The function slices the file and saves the result in a similar path to the original.
+@lru_cache(maxsize=None)
+def _word_key(word):
+    """Returns the word in the form used for the keys of robot_times (without special characters and in lower case),
+    cached as the same words repeat across all the participants"""
+    return unidecode(word).lower()
+
+
+def process_wav_file(input_file, audio_data, sample_rate, output_directory, relative_path, robot_times,
+                     reduced_noise=None):
+    """ The function slices the already loaded file and saves the result in a similar path to the original.
     The function returns features that cannot be extracted after the slicing is done, like reaction time"""
 
     if not input_file.endswith(".wav"):
         return
 
-    audio_data, sample_rate = librosa.load(input_file)
     file_name = input_file
 
-    pattern = r'\((.*?)\)'  # This regular expression captures content inside parentheses
-    match = re.search(pattern, file_name)
+    match = WORD_PATTERN.search(os.path.basename(file_name))
 
-    word = match.group(1)
+    word = _word_key(match.group(1))
 
     # Modify content as needed
     sliced_audio_file, onset, total_duration = slice_noise_reduced_audio_files_byt(audio_file=audio_data, word=word,
                                                                                    audio_rate=sample_rate,
-                                                                                   files_name=file_name)
+                                                                                   files_name=file_name,
+                                                                                   reduced_noise=reduced_noise)
 
     real_onset = onset - robot_times[word]
 
@@ -153,49 +327,169 @@ def process_wav_file(input_file, output_directory, relative_path, robot_times):
 
     # Create the output file with the same relative path in the specified directory
     if to_include:
-        sf.write(output_file, sliced_audio_file, int(sample_rate))
+        try:
+            _write_sliced_file(output_file, sliced_audio_file, int(sample_rate))
+        except Exception as e:  # a file that couldn't be written is left out of the csv instead of listed there
+            print("could not write " + output_file + ": " + str(e))
+            to_include = False
     else:
         print("not included: " + output_file)
 
     return features, to_include
 
 
-def ig_f(dir, files):
-    return [f for f in files if os.path.isfile(os.path.join(dir, f))]
+def _write_sliced_file(output_file, sliced_audio_file, sample_rate):
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    sf.write(output_file, sliced_audio_file, sample_rate, subtype='PCM_16')
+
+
+# robot_times of the worker process, set once when the worker starts instead of being pickled with every file
+_worker_robot_times = None
 
 
-def copy_directory_with_wav_processing(source_directory, destination_directory, robot_times):
-    """Receives the source directory and copies its structure before adding all the sliced files.
-    In addition, this function collects all the reactions and duration features and compiles them
-    in a single csv file"""
+def _init_worker(robot_times):
+    global _worker_robot_times
+    _worker_robot_times = robot_times
 
-    # Copy the directory tree
-    shutil.copytree(source_directory, destination_directory, ignore=ig_f)  # copying only the directory structure
 
-    count = 0
+def _sliceable_files(loaded_files):
+    """Returns the indices of the loaded files (all with the same sample rate) that aren't rejected before the
+    noise suppression"""
+    frame_size, hop_length = _frame_sizes(loaded_files[0][3])
+    return [i for i, (_, _, audio_data, _) in enumerate(loaded_files)
+            if _can_be_sliced(audio_data, frame_size, hop_length)]
 
-    slice_features = pd.DataFrame(columns=['File_name', 'Reaction_time(s)', 'Total_duration(s)'])
 
-    # Walk through the copied directory and process each WAV file
-    for root, _, files in os.walk(source_directory):
-        for file in files:
-            if file.lower().endswith('.wav'):
-                # if count == 500: # uncomment if you wish to stop early for testing
-                #     break
+def _process_wav_directory_in_worker(batch, output_directory):
+    """Slices a batch of loaded files of one directory (all with the same sample rate), reducing the noise
+    of all of them in a single call with the noise profile of the directory"""
+    loaded_files, noise_profile = batch
+    sample_rate = loaded_files[0][3]
+
+    # the recordings rejected before the noise suppression are left out of the batch
+    to_reduce = _sliceable_files(loaded_files)
+    reduced_files = _reduce_noise_batch([loaded_files[i][2] for i in to_reduce], sample_rate, noise_profile)
+    reduced_noise = dict(zip(to_reduce, reduced_files))
+
+    return [process_wav_file(file_path, audio_data, sample_rate, output_directory, relative_path,
+                             _worker_robot_times, reduced_noise=reduced_noise.get(i))
+            for i, (file_path, relative_path, audio_data, sample_rate) in enumerate(loaded_files)]
+
+
+def _wav_files(directory, prefix_length):
+    """Yields the path of every WAV file under the directory with its path relative to the source directory,
+    whose path with the trailing separator is prefix_length long. A directory's files come before the files of
+    its subdirectories, in the same order as os.walk, so the files of a directory stay consecutive.
+    Like os.walk, symbolic links to directories are not followed and directories that cannot be read are skipped"""
+    subdirectories = []
+    try:
+        entries = os.scandir(directory)
+    except OSError as e:
+        print("could not read " + directory + ": " + str(e))
+        return
+
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.name.lower().endswith('.wav'):
+                yield entry.path, entry.path[prefix_length:]
+
+    for subdirectory in subdirectories:
+        yield from _wav_files(subdirectory, prefix_length)
+
+
+def _split_batches(directory_files, max_samples):
+    """Splits the loaded files of a directory into consecutive batches of at most max_samples samples
+    (a longer file makes a batch of its own)"""
+    batch, batch_samples = [], 0
+    for loaded_file in directory_files:
+        if batch and batch_samples + loaded_file[2].size > max_samples:
+            yield batch
+            batch, batch_samples = [], 0
+        batch.append(loaded_file)
+        batch_samples += loaded_file[2].size
+    yield batch
+
+
+def _loaded_batches(loaded_files):
+    """Groups the consecutive loaded files that share a directory and a sample rate into batches of at most
+    MAX_BATCH_S seconds of audio, each given with the noise profile of its directory. That profile is taken
+    once, from the first batch of the directory with recordings that can be sliced, and shared by all its
+    batches, so the noise of the whole directory is estimated from the same audio without holding all of it"""
+    for (_, sample_rate), directory_files in groupby(loaded_files,
+                                                     key=lambda loaded_file: (os.path.dirname(loaded_file[1]),
+                                                                              loaded_file[3])):
+        noise_profile = None
+        for batch in _split_batches(directory_files, MAX_BATCH_S * sample_rate):
+            if noise_profile is None:
+                noise_profile = _noise_profile([batch[i][2] for i in _sliceable_files(batch)], sample_rate)
+            yield batch, noise_profile
+
+
+def _load_wav_file(paths):
+    file_path, relative_path = paths
+    audio_data, sample_rate = sf.read(file_path, dtype='float32', always_2d=False)
+    if audio_data.ndim > 1:
+        audio_data = audio_data.mean(axis=1)  # mixing down to mono like librosa.load does
+    return file_path, relative_path, audio_data, sample_rate
+
+
+def _bounded_map(executor, fn, items, max_pending):
+    """Like executor.map, but submits only max_pending items at a time, so the items are taken lazily
+    as the results are consumed instead of all being queued at once"""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def copy_directory_with_wav_processing(source_directory, destination_directory, robot_times,
+                                       destination_sliced_features_path):
+    """Receives the source directory and puts all the sliced files in the destination directory, in the same
+    structure as the source directory. In addition, this function collects all the reactions and duration
+    features and writes them to a single csv file as the files are processed"""
+
+    # The WAV files are found lazily as the loading threads ask for more, with their relative path within the
+    # directory structure
+    wav_files = _wav_files(source_directory, len(os.path.join(source_directory, '')))
+
+    # wav_files = itertools.islice(wav_files, 500)  # uncomment (importing itertools) to stop early for testing
+
+    # Read the files on a few threads while the worker processes slice the ones read before them, a batch of a
+    # directory at a time, the results come back in the same order as wav_files. The workers are spawned rather
+    # than forked, forking while the reading threads are running can leave a worker stuck on a lock one of them held
+    with open(destination_sliced_features_path, 'w', newline='') as features_file, \
+            ThreadPoolExecutor(max_workers=PREFETCH_THREADS) as loader, \
+            ProcessPoolExecutor(max_workers=NUM_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                initializer=_init_worker, initargs=(robot_times,)) as executor:
+        # the features of the included files are written as soon as they come back, with a leading index
+        # column like the one DataFrame.to_csv used to write
+        features_writer = csv.writer(features_file, lineterminator='\n')
+        features_writer.writerow(['', 'File_name', 'Reaction_time(s)', 'Total_duration(s)'])
+        included = 0
+
+        loaded_files = _bounded_map(loader, _load_wav_file, wav_files, PREFETCH_QUEUE_SIZE)
+        results = _bounded_map(executor,
+                               partial(_process_wav_directory_in_worker, output_directory=destination_directory),
+                               _loaded_batches(loaded_files), MAX_PENDING_BATCHES)
+        count = 0
+        for directory_results in results:
+            for file_features, to_include in directory_results:
                 if count % 100 == 0:
                     print("copied ", count, " files")
 
-                file_path = os.path.join(root, file)
-                # Get the relative path within the directory structure
-                relative_path = os.path.relpath(file_path, source_directory)
-
-                file_features, to_include = process_wav_file(file_path, destination_directory,
-                                                             relative_path, robot_times)
                 if to_include:
-                    slice_features.loc[len(slice_features.index)] = file_features
+                    features_writer.writerow([included] + file_features)
+                    included += 1
 
                 count += 1
-    return slice_features
+
+            # a crash later on still leaves the features of the batches done so far in the csv
+            features_file.flush()
 
 
 def main():
@@ -206,9 +500,9 @@ def main():
     robot_times = df.set_index('Word')['Modified Duration'].to_dict()
     robot_times = {unidecode(key).lower(): value for key, value in robot_times.items()}
 
-    sliced_features = copy_directory_with_wav_processing(source_directory, destination_directory, robot_times)
-    sliced_features.to_csv(destination_sliced_features_path)
-    print(sliced_features.info())
+    copy_directory_with_wav_processing(source_directory, destination_directory, robot_times,
+                                       destination_sliced_features_path)
+    print(pd.read_csv(destination_sliced_features_path, index_col=0).info())
 
 
 if __name__ == "__main__":